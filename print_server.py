@@ -10,18 +10,93 @@ VERSION = "1.1.0"
 GITHUB_REPO = "namanjain6767/textile-print-server"
 UPDATE_CHECK_ENABLED = True
 
+# Layout settings
+PAPER_CHARS_PER_LINE = 32       # Normal-size characters per line (58mm: 32, 80mm: 48)
+MULTI_UP_GUTTER = " | "         # Separator between slips printed side by side
+MULTI_UP_MIN_COLUMN_WIDTH = 14  # Narrowest slip column allowed in multi-up layout
+NUMBER_GRID_GAP = 2             # Spaces between numbers in compact mode
+
+# Printer capability settings
+PRINTER_PROBE_ENABLED = True    # Query new printers once and save their capability profile
+PRINTER_PROFILES_PATH = None    # JSON file (default: printer_profiles.json next to the exe/script)
+PRINTER_CHUNK_SIZE = 4096       # Largest single write to the printer
+SERIAL_BAUD_RATES = [9600, 19200, 38400, 57600, 115200]  # Tried in order when probing serial printers
+
+# Memory settings
+LOW_MEMORY_MODE = False         # Enforce MEMORY_BUDGET_BYTES and spill queued jobs to disk past it
+MEMORY_BUDGET_BYTES = 8 * 1024 * 1024  # Bytes allowed across request bodies, parsed jobs and receipts
+PARSED_JSON_OVERHEAD = 4        # Parsed job size as a multiple of its JSON size (estimate)
+
+# Network settings
+HTTP_PORT = 9100                # JSON HTTP API
+RAW_PORT = None                 # Raw ESC/POS pass-through port (e.g. 9101), None to disable
+RAW_CHUNK_SIZE = 4096           # Bytes copied to the printer per write on the raw port
+RAW_IDLE_TIMEOUT = 10.0         # Seconds of silence that end a raw job
+RAW_MAX_JOB_SECONDS = 120.0     # A raw job holding the printer longer than this is ended
+UNIX_SOCKET_PATH = None         # Local job socket (e.g. /run/thermal-print-server/print.sock), None to disable
+UNIX_SOCKET_MODE = 0o660        # Permissions for the socket file
+
+# Logging settings
+LOG_LEVEL = "info"              # Minimum level written to the console (debug/info/warning/error)
+LOG_JSON = False                # Write console records as JSON lines instead of plain text
+LOG_BUFFER_SIZE = 1000          # Records kept in memory and served at GET /logs
+LOG_QUEUE_SIZE = 10000          # Console records waiting for the writer before new ones are dropped
+LOG_RATE_LIMIT_SECONDS = 5.0    # Identical console messages inside this window are collapsed into one
+
+# Fault recovery settings
+RECOVERY_MAX_ATTEMPTS = 5       # Write attempts per receipt before the job gives up
+RECOVERY_INITIAL_DELAY = 0.5    # Seconds before the first reconnect, doubled on each retry
+RECOVERY_MAX_DELAY = 8.0        # Upper bound on the reconnect backoff
+JOB_CHECKPOINT_LIMIT = 200      # Recent job checkpoints kept for GET /job
+
+# mDNS settings
+MDNS_HOSTNAME = None                       # Extra alias, e.g. "printserver" for printserver.local; set on one server per LAN
+MDNS_SERVICE_TYPE = "_thermalprint._tcp.local."
+MDNS_ALIAS_SERVICE_TYPE = "_printalias._tcp.local."  # Carries the MDNS_HOSTNAME alias only
+MDNS_MIN_UPDATE_SECONDS = 5.0              # Minimum gap between TXT record refreshes
+
+# Admission control settings
+ADMISSION_MAX_BODY_BYTES = 2 * 1024 * 1024  # Larger request bodies are rejected with 413
+ADMISSION_MAX_ENTRIES = 200                 # Receipts allowed in one /print job (413 above this)
+ADMISSION_MAX_QUEUED_PER_CLIENT = 300       # Receipts one client may have waiting (429 above this)
+ADMISSION_MAX_QUEUED_TOTAL = 1000           # Receipts waiting across all clients (503 above this)
+
+# Diagnostics settings
+DEBUG_PROFILE_ENABLED = False   # Allow GET /debug/profile (samples the whole process - keep off in production)
+PROFILE_MAX_SECONDS = 60        # Longest profile a single request may take
+PROFILE_INTERVAL = 0.005        # Seconds between stack samples
+
+# Print history settings
+HISTORY_ENABLED = True          # Keep printed receipts for /reprint
+HISTORY_DB_PATH = None          # SQLite file (default: print_history.db next to the exe/script)
+HISTORY_RETENTION_DAYS = 90     # Receipts older than this are deleted (0 = keep forever)
+HISTORY_MAX_RECORDS = 100000    # Upper bound on stored receipts (0 = no limit)
+HISTORY_BATCH_SIZE = 50         # Receipts written per database transaction
+HISTORY_FLUSH_SECONDS = 2.0     # Longest a receipt waits before its batch is written
+
 import socket
 import json
+import re
 import struct
 import time
 import sys
 import os
 import urllib.request
 import tempfile
+import textwrap
 import shutil
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import stat
+import queue
+import collections
+import traceback
+from datetime import datetime
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import threading
+import contextlib
+import socketserver
+import uuid
 
 # Set up libusb DLL path for pyusb on Windows
 def setup_libusb():
@@ -56,6 +131,8 @@ setup_libusb()
 # ESC/POS Commands
 ESC = 0x1B
 GS = 0x1D
+DLE = 0x10
+EOT = 0x04
 
 COMMANDS = {
     'INIT': bytes([ESC, 0x40]),
@@ -74,20 +151,233 @@ COMMANDS = {
 # Global printer connection
 printer = None
 printer_name = "Not Connected"
+printer_in = None       # USB IN endpoint, for printers that answer queries
+printer_key = None      # Stable device identity used to look up the capability profile
+printer_profile = {}    # Capabilities of the connected printer (see load_printer_profile)
+
+# Logging - records are built on the caller's thread and written to the
+# console by a background thread, so a slow terminal or journald never
+# blocks a print request
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+log_buffer = collections.deque(maxlen=LOG_BUFFER_SIZE)
+log_stats = {'dropped': 0, 'suppressed': 0}
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_lock = threading.Lock()
+_log_recent = {}
+_log_thread = None
+
+def log_event(message: str, level: str = 'info', **fields):
+    """Record a structured log entry without blocking the caller"""
+    now = time.time()
+    
+    record = {
+        'time': datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+        'level': level,
+        'message': message,
+    }
+    record.update(fields)
+    
+    # Every record is kept for /logs; only the console is rate-limited
+    log_buffer.append(record)
+    
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS.get(LOG_LEVEL, 20):
+        return
+    
+    with _log_lock:
+        # Collapse console repeats of the same message inside the rate-limit window
+        recent = _log_recent.get(message)
+        if recent and now - recent[0] < LOG_RATE_LIMIT_SECONDS:
+            recent[1] += 1
+            log_stats['suppressed'] += 1
+            return
+        suppressed = recent[1] if recent else 0
+        if len(_log_recent) >= LOG_BUFFER_SIZE:
+            for key in [k for k, v in _log_recent.items() if now - v[0] >= LOG_RATE_LIMIT_SECONDS]:
+                del _log_recent[key]
+        _log_recent[message] = [now, 0]
+    
+    if suppressed:
+        record = dict(record, suppressed=suppressed)
+    
+    start_log_writer()
+    try:
+        _log_queue.put_nowait(record)
+    except queue.Full:
+        log_stats['dropped'] += 1
+
+def format_log_record(record: dict) -> str:
+    """Format a log record for the console"""
+    if LOG_JSON:
+        return json.dumps(record, default=str)
+
+    prefix = '' if record['level'] == 'info' else record['level'].upper() + ': '
+    line = f"[{record['time']}] {prefix}{record['message']}"
+    extras = [f"{k}={v}" for k, v in record.items()
+              if k not in ('time', 'level', 'message', 'traceback')]
+    if extras:
+        line += ' (' + ', '.join(extras) + ')'
+    if 'traceback' in record:
+        line += '\n' + record['traceback'].rstrip()
+    return line
+
+def _log_writer():
+    """Background thread that drains the log queue to stdout"""
+    while True:
+        record = _log_queue.get()
+        try:
+            if record is None:
+                return
+            sys.stdout.write(format_log_record(record) + '\n')
+            sys.stdout.flush()
+        except Exception:
+            pass
+        finally:
+            _log_queue.task_done()
+
+def start_log_writer():
+    """Start the background log writer if it is not running yet"""
+    global _log_thread
+    if _log_thread is not None:
+        return
+    with _log_lock:
+        if _log_thread is None:
+            _log_thread = threading.Thread(target=_log_writer, name='log-writer', daemon=True)
+            _log_thread.start()
+
+def flush_logs():
+    """Wait until every queued log record has been written"""
+    if _log_thread is not None and _log_thread.is_alive():
+        _log_queue.join()
+
+def stop_log_writer():
+    """Flush pending records and stop the background writer"""
+    global _log_thread
+    if _log_thread is None:
+        return
+    flush_logs()
+    _log_queue.put(None)
+    _log_thread.join(timeout=2)
+    _log_thread = None
+
+def get_logs(limit: int = 100, level: str = None, job_id: str = None) -> list:
+    """Return the most recent buffered records, newest last"""
+    records = list(log_buffer)
+    if level:
+        min_level = LOG_LEVELS.get(level, 0)
+        records = [r for r in records if LOG_LEVELS.get(r['level'], 20) >= min_level]
+    if job_id:
+        records = [r for r in records if r.get('job_id') == job_id]
+    return records[-limit:] if limit > 0 else records
+
+# Request timing - stage durations for the current request are collected
+# per thread and returned in the Server-Timing response header
+_request_timings = threading.local()
+
+def reset_timings():
+    """Start collecting stage timings for a new request on this thread"""
+    _request_timings.start = time.time()
+    _request_timings.stages = {}
+
+def add_timing(stage: str, seconds: float):
+    """Add time spent in a stage to the current request's timings"""
+    stages = getattr(_request_timings, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+def format_server_timing() -> str:
+    """Format the current request's timings as a Server-Timing header value"""
+    stages = getattr(_request_timings, 'stages', None)
+    if stages is None:
+        return None
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items()]
+    parts.append(f"total;dur={(time.time() - _request_timings.start) * 1000:.1f}")
+    return ', '.join(parts)
+
+# Sampling profiler - periodically snapshots every thread's stack, so it
+# can be pointed at a running server without restarting it under cProfile
+_profile_lock = threading.Lock()
+
+def sample_stacks(seconds: float, interval: float) -> collections.Counter:
+    """Sample all other threads' stacks; keys are (thread name, frames root-first)"""
+    own_ident = threading.get_ident()
+    samples = collections.Counter()
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            samples[(names.get(ident, str(ident)),) + tuple(stack)] += 1
+        time.sleep(interval)
+    return samples
+
+def format_collapsed(samples: collections.Counter) -> bytes:
+    """Format samples as collapsed stacks (flamegraph.pl / speedscope input)"""
+    lines = []
+    for key, count in samples.items():
+        frames = [key[0]] + [f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in key[1:]]
+        lines.append(';'.join(frames) + f" {count}")
+    return ('\n'.join(sorted(lines)) + '\n').encode('utf-8')
+
+def format_pstats(samples: collections.Counter, interval: float) -> bytes:
+    """Format samples as a marshalled pstats file (load with pstats.Stats)"""
+    import marshal
+    stats = {}
+    for key, count in samples.items():
+        stack = key[1:]
+        if not stack:
+            continue
+        seconds = count * interval
+        seen = set()
+        for depth, func in enumerate(stack):
+            entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+            is_leaf = depth == len(stack) - 1
+            if is_leaf:
+                entry[2] += seconds
+            # Recursive frames count once towards cumulative time
+            if func not in seen:
+                seen.add(func)
+                entry[0] += count
+                entry[1] += count
+                entry[3] += seconds
+            if depth > 0:
+                caller = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                caller[0] += count
+                caller[1] += count
+                caller[2] += seconds if is_leaf else 0.0
+                caller[3] += seconds
+    stats = {
+        func: (cc, nc, tt, ct, {caller: tuple(values) for caller, values in callers.items()})
+        for func, (cc, nc, tt, ct, callers) in stats.items()
+    }
+    return marshal.dumps(stats)
+
+_local_ip_cache = {'ip': None, 'time': 0.0}
 
 def get_local_ip():
-    """Get the local IP address of this machine"""
+    """Get the local IP address of this machine (cached for 30 seconds)"""
+    if _local_ip_cache['ip'] and time.time() - _local_ip_cache['time'] < 30:
+        return _local_ip_cache['ip']
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
         s.close()
-        return ip
     except:
-        return "127.0.0.1"
+        ip = "127.0.0.1"
+    _local_ip_cache['ip'] = ip
+    _local_ip_cache['time'] = time.time()
+    return ip
 
 def scan_all_usb_devices():
-    """Scan and print all USB devices for debugging"""
+    """Scan and log all USB devices for debugging"""
     try:
         import usb.core
         import usb.backend.libusb1 as libusb1
@@ -95,26 +385,26 @@ def scan_all_usb_devices():
         # Get the backend
         backend = libusb1.get_backend()
         if backend is None:
-            print("libusb backend not available")
+            log_event("libusb backend not available", 'warning')
             return []
         
-        print("\n=== Scanning all USB devices ===")
         devices = list(usb.core.find(find_all=True, backend=backend))
         if not devices:
-            print("No USB devices found")
+            log_event("No USB devices found", 'warning')
             return []
         
+        # Device list is debug-level: kept in /logs, hidden from the console by default
         for dev in devices:
             try:
                 product = dev.product or "Unknown"
-                print(f"  VID:0x{dev.idVendor:04x} PID:0x{dev.idProduct:04x} - {product}")
             except:
-                print(f"  VID:0x{dev.idVendor:04x} PID:0x{dev.idProduct:04x}")
-        print("================================\n")
+                product = "Unknown"
+            log_event(f"USB device VID:0x{dev.idVendor:04x} PID:0x{dev.idProduct:04x} - {product}", 'debug')
+        log_event(f"Scanned {len(devices)} USB devices", 'debug')
         return devices
         
     except Exception as e:
-        print(f"Scan error: {e}")
+        log_event(f"Scan error: {e}", 'error')
         return []
 
 def find_printer_usb():
@@ -129,7 +419,7 @@ def find_printer_usb():
         # Get backend with DLL
         backend = libusb1.get_backend()
         if backend is None:
-            print("libusb backend not found. Make sure libusb DLL is available.")
+            log_event("libusb backend not found. Make sure libusb DLL is available.", 'warning')
             return False
         
         # Scan all devices first for debugging
@@ -145,7 +435,7 @@ def find_printer_usb():
             try:
                 product = (dev.product or "").lower()
                 if 'printer' in product or 'thermal' in product or 'h58' in product:
-                    print(f"Found printer by name: {dev.product}")
+                    log_event(f"Found printer by name: {dev.product}")
                     return connect_pyusb_printer(dev)
             except:
                 continue
@@ -153,7 +443,7 @@ def find_printer_usb():
         # Try known vendor IDs
         for dev in devices:
             if dev.idVendor in known_vids:
-                print(f"Found device with known printer VID: 0x{dev.idVendor:04x}")
+                log_event(f"Found device with known printer VID: 0x{dev.idVendor:04x}")
                 result = connect_pyusb_printer(dev)
                 if result:
                     return True
@@ -166,21 +456,19 @@ def find_printer_usb():
                 if result:
                     return True
         
-        print("✗ No USB printer found")
+        log_event("✗ No USB printer found", 'warning')
         return False
         
     except ImportError as e:
-        print(f"pyusb import error: {e}")
+        log_event(f"pyusb import error: {e}", 'warning')
         return False
     except Exception as e:
-        print(f"USB error: {e}")
-        import traceback
-        traceback.print_exc()
+        log_event(f"USB error: {e}", 'error', traceback=traceback.format_exc())
         return False
 
 def connect_pyusb_printer(dev):
     """Connect to a USB device using pyusb"""
-    global printer, printer_name
+    global printer, printer_name, printer_in, printer_key
     import usb.core
     import usb.util
     
@@ -195,7 +483,7 @@ def connect_pyusb_printer(dev):
             dev.set_configuration()
         except usb.core.USBError as e:
             if "Resource busy" not in str(e) and "already set" not in str(e).lower():
-                print(f"  Config error: {e}")
+                log_event(f"Config error: {e}", 'warning')
         
         cfg = dev.get_active_configuration()
         intf = cfg[(0, 0)]
@@ -205,23 +493,34 @@ def connect_pyusb_printer(dev):
             custom_match=lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_OUT
         )
         
+        ep_in = usb.util.find_descriptor(
+            intf,
+            custom_match=lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_IN
+        )
+        
         if ep_out:
             printer = ep_out
+            printer_in = ep_in
             printer_name = dev.product or f"USB Printer (VID:0x{dev.idVendor:04x})"
-            print(f"✓ Connected via pyusb: {printer_name}")
+            try:
+                serial_number = dev.serial_number or ''
+            except Exception:
+                serial_number = ''
+            printer_key = f"usb:{dev.idVendor:04x}:{dev.idProduct:04x}:{serial_number}"
+            log_event(f"✓ Connected via pyusb: {printer_name}", printer=printer_name)
             return True
         return False
             
     except usb.core.USBError as e:
-        print(f"  USB error: {e}")
+        log_event(f"USB error: {e}", 'warning')
         return False
     except Exception as e:
-        print(f"  Error: {e}")
+        log_event(f"Error: {e}", 'warning')
         return False
 
 def find_printer_windows():
     """Find and connect to USB thermal printer on Windows"""
-    global printer, printer_name
+    global printer, printer_name, printer_key
     
     # Try pyusb FIRST (for WinUSB driver from Zadig)
     if find_printer_usb():
@@ -268,23 +567,24 @@ def find_printer_windows():
         if thermal_printer:
             printer_name = thermal_printer
             printer = win32print.OpenPrinter(thermal_printer)
-            print(f"✓ Connected to Windows printer: {thermal_printer}")
+            printer_key = f"win32:{thermal_printer}"
+            log_event(f"✓ Connected to Windows printer: {thermal_printer}", printer=printer_name)
             return True
         else:
-            print("✗ No thermal printer found (skipped non-thermal printers like OneNote, PDF, etc.)")
-            print("  Please install WinUSB driver using Zadig for direct USB access")
+            log_event("✗ No thermal printer found (skipped non-thermal printers like OneNote, PDF, etc.)", 'warning')
+            log_event("Please install WinUSB driver using Zadig for direct USB access", 'warning')
             return False
             
     except ImportError:
-        print("win32print not available")
+        log_event("win32print not available", 'warning')
         return False
     except Exception as e:
-        print(f"Error connecting to Windows printer: {e}")
+        log_event(f"Error connecting to Windows printer: {e}", 'error')
         return False
 
 def find_printer_serial():
     """Find thermal printer via serial port"""
-    global printer, printer_name
+    global printer, printer_name, printer_key
     try:
         import serial
         import serial.tools.list_ports
@@ -296,7 +596,11 @@ def find_printer_serial():
                     ser = serial.Serial(port.device, 9600, timeout=1)
                     printer = ser
                     printer_name = f"Serial: {port.device}"
-                    print(f"✓ Connected to serial printer: {port.device}")
+                    if port.vid is not None:
+                        printer_key = f"serial:{port.vid:04x}:{port.pid:04x}:{port.serial_number or ''}"
+                    else:
+                        printer_key = f"serial:{port.device}"
+                    log_event(f"✓ Connected to serial printer: {port.device}", printer=printer_name)
                     return True
                 except:
                     continue
@@ -307,18 +611,43 @@ def find_printer_serial():
                 ser = serial.Serial(port_name, 9600, timeout=1)
                 printer = ser
                 printer_name = f"Serial: {port_name}"
-                print(f"✓ Connected to serial port: {port_name}")
+                printer_key = f"serial:{port_name}"
+                log_event(f"✓ Connected to serial port: {port_name}", printer=printer_name)
                 return True
             except:
                 continue
         
-        print("✗ No serial printer found")
+        log_event("✗ No serial printer found", 'warning')
         return False
         
     except ImportError:
-        print("pyserial not available")
+        log_event("pyserial not available", 'warning')
         return False
 
+# Spooler document kept open across writes by printer_document()
+spooler_doc = {'active': False, 'handle': None, 'name': "Print Job"}
+
+@contextlib.contextmanager
+def printer_document(name: str = "Print Job"):
+    """Send every write inside the block as one spooler document
+
+    Only the Windows spooler needs this; USB and serial writes are already a
+    plain stream. The caller must hold the printer.
+    """
+    spooler_doc.update(active=True, handle=None, name=name)
+    try:
+        yield
+    finally:
+        handle = spooler_doc['handle']
+        spooler_doc.update(active=False, handle=None)
+        if handle is not None and handle == printer:
+            try:
+                import win32print
+                win32print.EndPagePrinter(handle)
+                win32print.EndDocPrinter(handle)
+            except Exception as e:
+                log_event(f"Closing spooler document failed: {e}", 'warning', printer=printer_name)
+
 def send_to_printer(data: bytes):
     """Send raw bytes to the printer"""
     global printer
@@ -328,27 +657,88 @@ def send_to_printer(data: bytes):
     
     try:
         # USB endpoint (pyusb) - has bEndpointAddress
-        if hasattr(printer, 'bEndpointAddress'):
-            printer.write(data)
         # Serial printer - has write and baudrate
-        elif hasattr(printer, 'write') and hasattr(printer, 'baudrate'):
-            printer.write(data)
+        if hasattr(printer, 'bEndpointAddress') or (hasattr(printer, 'write') and hasattr(printer, 'baudrate')):
+            # Write in chunks sized for this printer's buffer, pausing between
+            # them if its profile asks for pacing
+            chunk_size = printer_profile.get('chunkSize') or len(data) or 1
+            chunk_delay = printer_profile.get('chunkDelay', 0)
+            view = memoryview(data)
+            for offset in range(0, len(data), chunk_size):
+                printer.write(view[offset:offset + chunk_size])
+                if chunk_delay and offset + chunk_size < len(data):
+                    time.sleep(chunk_delay)
         # Windows printer handle (integer from OpenPrinter)
         elif isinstance(printer, int):
             import win32print
-            hJob = win32print.StartDocPrinter(printer, 1, ("Print Job", None, "RAW"))
-            win32print.StartPagePrinter(printer)
-            win32print.WritePrinter(printer, data)
-            win32print.EndPagePrinter(printer)
-            win32print.EndDocPrinter(printer)
+            if spooler_doc['active']:
+                # Streamed job - open the document once, on the current handle
+                if spooler_doc['handle'] != printer:
+                    win32print.StartDocPrinter(printer, 1, (spooler_doc['name'], None, "RAW"))
+                    win32print.StartPagePrinter(printer)
+                    spooler_doc['handle'] = printer
+                win32print.WritePrinter(printer, data)
+            else:
+                hJob = win32print.StartDocPrinter(printer, 1, ("Print Job", None, "RAW"))
+                win32print.StartPagePrinter(printer)
+                win32print.WritePrinter(printer, data)
+                win32print.EndPagePrinter(printer)
+                win32print.EndDocPrinter(printer)
         else:
             raise Exception("Unknown printer type")
             
         return True
     except Exception as e:
-        print(f"Print error: {e}")
+        log_event(f"Print error: {e}", 'error', printer=printer_name)
         raise
 
+def disconnect_printer():
+    """Release the current printer handle so it can be reopened"""
+    global printer, printer_name, printer_in, printer_key
+    old_printer = printer
+    printer = None
+    printer_in = None
+    printer_key = None
+    printer_name = "Not Connected"
+    # A document open on the old handle is gone with it
+    spooler_doc['handle'] = None
+    
+    try:
+        if hasattr(old_printer, 'bEndpointAddress'):
+            import usb.util
+            usb.util.dispose_resources(old_printer.device)
+        elif hasattr(old_printer, 'close') and hasattr(old_printer, 'baudrate'):
+            old_printer.close()
+        elif isinstance(old_printer, int):
+            import win32print
+            win32print.ClosePrinter(old_printer)
+    except Exception:
+        pass
+
+def send_with_recovery(data: bytes, job_id: str = None):
+    """Send bytes to the printer, reconnecting with backoff if the write fails"""
+    delay = RECOVERY_INITIAL_DELAY
+    for attempt in range(1, RECOVERY_MAX_ATTEMPTS + 1):
+        send_start = time.time()
+        try:
+            return send_to_printer(data)
+        except Exception as e:
+            if attempt == RECOVERY_MAX_ATTEMPTS:
+                raise
+            error = e
+        finally:
+            add_timing('send', time.time() - send_start)
+        
+        add_timing('recover', delay)
+        log_event(f"Printer write failed, reconnecting in {delay:.1f}s (attempt {attempt})", 'warning',
+                  job_id=job_id, error=str(error))
+        time.sleep(delay)
+        delay = min(delay * 2, RECOVERY_MAX_DELAY)
+        reconnect_start = time.time()
+        disconnect_printer()
+        connect_printer()
+        add_timing('reconnect', time.time() - reconnect_start)
+
 def format_line(left: str, right: str, width: int = 12) -> str:
     """Format a line with left and right text"""
     spaces = width - len(left) - len(right)
@@ -356,14 +746,38 @@ def format_line(left: str, right: str, width: int = 12) -> str:
         return left + ' ' + right
     return left + ' ' * spaces + right
 
-def print_receipt(entry: dict, settings: dict = None, is_last: bool = False):
-    """Print a single receipt - supports both old and new multi-color format"""
+def number_lines(numbers: list, settings: dict, width: int) -> list:
+    """Format a color's numbers as text lines - one per line, or a compact grid"""
+    texts = [f"{num:.2f}" for num in numbers]
+    if not settings.get('compact') or not texts:
+        return texts
+    
+    # Size the grid from the widest number and the available line width
+    cell = max(len(text) for text in texts) + NUMBER_GRID_GAP
+    fit = max(1, width // cell)
+    columns = max(1, min(int(settings.get('numberColumns') or fit), fit))
+    
+    lines = []
+    for start in range(0, len(texts), columns):
+        row = texts[start:start + columns]
+        # Pad short rows on the right so columns line up when right-aligned
+        lines.append(''.join(text.rjust(cell) for text in row) + ' ' * (cell * (columns - len(row))))
+    return lines
+
+def render_receipt(entry: dict, settings: dict = None, is_last: bool = False) -> bytes:
+    """Render a single receipt to ESC/POS bytes - supports both old and new multi-color format"""
     if settings is None:
         settings = {}
     
     custom_name = settings.get('customName')
     show_date = settings.get('showDate', False)
     white_space = settings.get('whiteSpace', 3)
+    chars_per_line = int(settings.get('charsPerLine') or PAPER_CHARS_PER_LINE)
+    # A completely full line makes some printers wrap, so leave one column free
+    grid_width = chars_per_line - 1
+    # Double-size header and separators keep the 58mm proportions (12 and 24 on 32 columns)
+    header_width = chars_per_line // 2 - 4
+    rule_width = chars_per_line - 8
     
     data = bytearray()
     
@@ -386,7 +800,7 @@ def print_receipt(entry: dict, settings: dict = None, is_last: bool = False):
     # Header: Marka+Lot and Serial #
     data.extend(COMMANDS['BOLD_ON'])
     data.extend(COMMANDS['DOUBLE_SIZE_ON'])
-    header = format_line(entry['markaLotNumber'], f"#{serial_number}", 12)
+    header = format_line(entry['markaLotNumber'], f"#{serial_number}", header_width)
     data.extend(header.encode('utf-8'))
     data.extend(COMMANDS['LINE_FEED'])
     data.extend(COMMANDS['NORMAL_SIZE'])
@@ -405,13 +819,13 @@ def print_receipt(entry: dict, settings: dict = None, is_last: bool = False):
             data.extend(COMMANDS['LINE_FEED'])
             
             # Separator
-            data.extend(b'------------------------')
+            data.extend(b'-' * rule_width)
             data.extend(COMMANDS['LINE_FEED'])
             
             # Numbers (right-aligned)
             data.extend(COMMANDS['ALIGN_RIGHT'])
-            for num in numbers:
-                data.extend(f"{num:.2f}".encode('utf-8'))
+            for line in number_lines(numbers, settings, grid_width):
+                data.extend(line.encode('utf-8'))
                 data.extend(COMMANDS['LINE_FEED'])
             
             # Color total line
@@ -424,7 +838,7 @@ def print_receipt(entry: dict, settings: dict = None, is_last: bool = False):
         
         # Grand total for all colors
         grand_total = entry.get('total', 0)
-        data.extend(b'========================')
+        data.extend(b'=' * rule_width)
         data.extend(COMMANDS['LINE_FEED'])
         data.extend(COMMANDS['BOLD_ON'])
         data.extend(COMMANDS['DOUBLE_SIZE_ON'])
@@ -441,13 +855,13 @@ def print_receipt(entry: dict, settings: dict = None, is_last: bool = False):
         data.extend(COMMANDS['LINE_FEED'])
         
         # Separator
-        data.extend(b'------------------------')
+        data.extend(b'-' * rule_width)
         data.extend(COMMANDS['LINE_FEED'])
         
         # Numbers (right-aligned)
         data.extend(COMMANDS['ALIGN_RIGHT'])
-        for num in entry.get('numbers', []):
-            data.extend(f"{num:.2f}".encode('utf-8'))
+        for line in number_lines(entry.get('numbers', []), settings, grid_width):
+            data.extend(line.encode('utf-8'))
             data.extend(COMMANDS['LINE_FEED'])
         
         # Total line
@@ -481,7 +895,683 @@ def print_receipt(entry: dict, settings: dict = None, is_last: bool = False):
     # Feed and cut
     data.extend(COMMANDS['FEED_AND_CUT'])
     
-    send_to_printer(bytes(data))
+    return bytes(data)
+
+def multi_up_layout(settings: dict) -> tuple:
+    """Work out (columns, column width) for multi-up printing"""
+    columns = int(settings.get('columns', 1) or 1)
+    chars_per_line = int(settings.get('charsPerLine') or PAPER_CHARS_PER_LINE)
+    if columns < 1:
+        raise ValueError('columns must be at least 1')
+    width = (chars_per_line - len(MULTI_UP_GUTTER) * (columns - 1)) // columns
+    if columns > 1 and width < MULTI_UP_MIN_COLUMN_WIDTH:
+        raise ValueError(f'{columns} columns do not fit in {chars_per_line} characters per line')
+    return columns, width
+
+def slip_lines(entry: dict, settings: dict, width: int) -> list:
+    """Lay out one bale slip as (text, bold) lines of at most width characters
+
+    Text longer than the column is wrapped onto further lines, never cut off.
+    """
+    custom_name = settings.get('customName')
+    show_date = settings.get('showDate', False)
+    lines = []
+    
+    def wrap(text):
+        return [text] if len(text) <= width else textwrap.wrap(text, width)
+    
+    def add(text, bold=False, align=str.ljust):
+        lines.extend((align(part, width), bold) for part in wrap(text))
+    
+    if custom_name:
+        add(custom_name, True, str.center)
+        add('')
+    
+    # Get serial number (support both 'serialNumber' and 'baleNumber')
+    serial_number = entry.get('serialNumber') or entry.get('baleNumber', 0)
+    lot, serial = str(entry['markaLotNumber']), f"#{serial_number}"
+    if len(lot) + 1 + len(serial) <= width:
+        add(format_line(lot, serial, width), True)
+    else:
+        # Too long for one line - give the serial its own line
+        add(lot, True)
+        add(serial, True, str.rjust)
+    
+    if 'colors' in entry and isinstance(entry['colors'], list):
+        for color_group in entry['colors']:
+            add(color_group.get('color', ''))
+            add('-' * width)
+            for line in number_lines(color_group.get('numbers', []), settings, width):
+                add(line, align=str.rjust)
+            add('-' * 8, align=str.rjust)
+            add(f"{color_group.get('total', 0):.2f}", align=str.rjust)
+            add('')
+        add('=' * width)
+        add(f"{entry.get('total', 0):.2f}", True, str.rjust)
+    else:
+        add(entry.get('color', ''))
+        add('-' * width)
+        for line in number_lines(entry.get('numbers', []), settings, width):
+            add(line, align=str.rjust)
+        add('-' * 8, align=str.rjust)
+        add(f"{entry.get('total', 0):.2f}", True, str.rjust)
+    
+    if show_date:
+        add('')
+        add(datetime.now().strftime('%d-%m-%Y'), align=str.center)
+    
+    return lines
+
+def render_multi_up(entries: list, settings: dict = None, is_last: bool = False) -> bytes:
+    """Render several bale slips side by side on one receipt with a single cut"""
+    if settings is None:
+        settings = {}
+    
+    columns, width = multi_up_layout(settings)
+    white_space = settings.get('whiteSpace', 3)
+    slips = [slip_lines(entry, settings, width) for entry in entries[:columns]]
+    rows = max(len(slip) for slip in slips)
+    blank = (' ' * width, False)
+    
+    data = bytearray()
+    data.extend(COMMANDS['INIT'])
+    data.extend(COMMANDS['ALIGN_LEFT'])
+    
+    # Bold can be switched mid-line, so each column keeps its own emphasis
+    for row in range(rows):
+        bold = False
+        for col, slip in enumerate(slips):
+            text, cell_bold = slip[row] if row < len(slip) else blank
+            if col > 0:
+                if bold:
+                    data.extend(COMMANDS['BOLD_OFF'])
+                    bold = False
+                data.extend(MULTI_UP_GUTTER.encode('utf-8'))
+            if cell_bold != bold:
+                data.extend(COMMANDS['BOLD_ON'] if cell_bold else COMMANDS['BOLD_OFF'])
+                bold = cell_bold
+            # Pad every column but the last so the next one lines up
+            cell = text.ljust(width) if col < len(slips) - 1 else text.rstrip()
+            data.extend(cell.encode('utf-8'))
+        if bold:
+            data.extend(COMMANDS['BOLD_OFF'])
+        data.extend(COMMANDS['LINE_FEED'])
+    
+    # Add white space (blank lines) before cut - not on last receipt
+    if not is_last and white_space > 0:
+        for _ in range(white_space):
+            data.extend(COMMANDS['LINE_FEED'])
+    
+    data.extend(COMMANDS['FEED_AND_CUT'])
+    
+    return bytes(data)
+
+# Print history - every printed receipt is kept as compressed ESC/POS bytes
+# in a local SQLite database so it can be reprinted byte-for-byte. Inserts
+# are batched on a background thread so recording never slows printing.
+_history_queue = queue.Queue()
+_history_thread = None
+_history_lock = threading.Lock()
+history_available = True
+
+def get_history_db_path() -> str:
+    """Get the history database path (next to the exe or script by default)"""
+    if HISTORY_DB_PATH:
+        return HISTORY_DB_PATH
+    if getattr(sys, 'frozen', False):
+        base_dir = os.path.dirname(sys.executable)
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, 'print_history.db')
+
+def open_history_db():
+    """Open the history database, creating the schema if needed"""
+    import sqlite3
+    conn = sqlite3.connect(get_history_db_path(), timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS receipts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT,
+            lot TEXT,
+            serial TEXT,
+            printed_at REAL NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receipts_lot_serial ON receipts (lot, serial)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receipts_serial ON receipts (serial)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receipts_printed_at ON receipts (printed_at)')
+    conn.commit()
+    return conn
+
+def _history_writer():
+    """Background thread that writes queued receipts to SQLite in batches"""
+    global history_available
+    try:
+        conn = open_history_db()
+    except Exception as e:
+        log_event(f"Print history disabled: {e}", 'error')
+        history_available = False
+        return
+
+    last_prune = 0
+    while True:
+        item = _history_queue.get()
+        batch = []
+        waiters = []
+        deadline = time.time() + HISTORY_FLUSH_SECONDS
+        # Collect until the batch is full, the flush interval passes or a reader asks for a flush
+        while True:
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+                break
+            batch.append(item)
+            if len(batch) >= HISTORY_BATCH_SIZE:
+                break
+            try:
+                item = _history_queue.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                break
+
+        if batch:
+            try:
+                conn.executemany(
+                    'INSERT INTO receipts (job_id, lot, serial, printed_at, size, data) VALUES (?, ?, ?, ?, ?, ?)',
+                    batch)
+                conn.commit()
+            except Exception as e:
+                log_event(f"Print history write failed: {e}", 'error', receipts=len(batch))
+
+        if time.time() - last_prune > 3600:
+            last_prune = time.time()
+            try:
+                prune_history(conn)
+            except Exception as e:
+                log_event(f"Print history prune failed: {e}", 'warning')
+
+        for waiter in waiters:
+            waiter.set()
+
+def prune_history(conn):
+    """Drop receipts older than the retention period or beyond the record limit"""
+    if HISTORY_RETENTION_DAYS > 0:
+        cutoff = time.time() - HISTORY_RETENTION_DAYS * 86400
+        conn.execute('DELETE FROM receipts WHERE printed_at < ?', (cutoff,))
+    if HISTORY_MAX_RECORDS > 0:
+        conn.execute(
+            'DELETE FROM receipts WHERE id <= (SELECT id FROM receipts ORDER BY id DESC LIMIT 1 OFFSET ?)',
+            (HISTORY_MAX_RECORDS,))
+    conn.commit()
+
+def start_history_writer():
+    """Start the background history writer if it is not running yet"""
+    global _history_thread
+    if _history_thread is not None:
+        return
+    with _history_lock:
+        if _history_thread is None:
+            _history_thread = threading.Thread(target=_history_writer, name='history-writer', daemon=True)
+            _history_thread.start()
+
+def record_receipt(job_id: str, entry: dict, data: bytes):
+    """Queue a printed receipt for the history database"""
+    if not HISTORY_ENABLED or not history_available:
+        return
+    import zlib
+    serial_number = entry.get('serialNumber') or entry.get('baleNumber', 0)
+    start_history_writer()
+    _history_queue.put((
+        job_id,
+        str(entry.get('markaLotNumber', '')),
+        str(serial_number),
+        time.time(),
+        len(data),
+        zlib.compress(data),
+    ))
+
+def flush_history(timeout: float = 5.0):
+    """Wait until every queued receipt has been written to the database"""
+    if _history_thread is None or not _history_thread.is_alive():
+        return
+    done = threading.Event()
+    _history_queue.put(done)
+    done.wait(timeout)
+
+def find_history(lot: str = None, serial: str = None, date: str = None, job_id: str = None,
+                 limit: int = 50) -> list:
+    """Search printed receipts, newest first (without the stored bytes)"""
+    lookup_start = time.time()
+    flush_history()
+    conditions = []
+    params = []
+    if lot:
+        conditions.append('lot = ?')
+        params.append(lot)
+    if serial:
+        conditions.append('serial = ?')
+        params.append(str(serial))
+    if job_id:
+        conditions.append('job_id = ?')
+        params.append(job_id)
+    if date:
+        # Date is YYYY-MM-DD in local time
+        day_start = time.mktime(datetime.strptime(date, '%Y-%m-%d').timetuple())
+        conditions.append('printed_at >= ? AND printed_at < ?')
+        params.extend([day_start, day_start + 86400])
+
+    sql = 'SELECT id, job_id, lot, serial, printed_at, size FROM receipts'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY id DESC LIMIT ?'
+    params.append(limit)
+
+    conn = open_history_db()
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    add_timing('history', time.time() - lookup_start)
+    return [{
+        'id': row[0],
+        'jobId': row[1],
+        'markaLotNumber': row[2],
+        'serialNumber': row[3],
+        'printedAt': datetime.fromtimestamp(row[4]).strftime('%Y-%m-%d %H:%M:%S'),
+        'size': row[5],
+    } for row in rows]
+
+def existing_history_ids(receipt_ids: list) -> set:
+    """Which of receipt_ids are in the history (without loading their bytes)"""
+    lookup_start = time.time()
+    flush_history()
+    conn = open_history_db()
+    try:
+        placeholders = ','.join('?' * len(receipt_ids))
+        rows = conn.execute(f'SELECT id FROM receipts WHERE id IN ({placeholders})', receipt_ids).fetchall()
+    finally:
+        conn.close()
+    add_timing('history', time.time() - lookup_start)
+    return {row[0] for row in rows}
+
+def load_history_receipt(receipt_id: int) -> bytes:
+    """Load the stored ESC/POS bytes for a receipt, or None if not found"""
+    import zlib
+    lookup_start = time.time()
+    flush_history()
+    conn = open_history_db()
+    try:
+        row = conn.execute('SELECT data FROM receipts WHERE id = ?', (receipt_id,)).fetchone()
+    finally:
+        conn.close()
+    add_timing('history', time.time() - lookup_start)
+    return zlib.decompress(row[0]) if row else None
+
+# Admission control - the printer is a single serial resource, so requests
+# are admitted against a bounded receipt queue and rejected early (before
+# the body is read) when it is full, with Retry-After set from the
+# measured drain rate
+print_lock = threading.RLock()
+_queue_lock = threading.Lock()
+queue_state = {'receipts': 0, 'clients': {}}
+receipt_seconds = 1.0   # Moving average of seconds per receipt (including entry delay)
+
+def estimate_drain_seconds() -> float:
+    """Estimate how long the currently queued receipts will take to print"""
+    return queue_state['receipts'] * receipt_seconds
+
+def retry_after_seconds() -> int:
+    """Seconds a rejected client should wait before retrying"""
+    return max(1, int(estimate_drain_seconds() + 0.999))
+
+def check_admission(client: str, count: int):
+    """Return (status, error) if the queue cannot take count more receipts, else None"""
+    if queue_state['receipts'] + count > ADMISSION_MAX_QUEUED_TOTAL:
+        return 503, 'Print queue is full'
+    if queue_state['clients'].get(client, 0) + count > ADMISSION_MAX_QUEUED_PER_CLIENT:
+        return 429, 'Too many queued receipts for this client'
+    return None
+
+def reserve_receipts(client: str, count: int):
+    """Add receipts to the queue, or return (status, error) if they do not fit"""
+    with _queue_lock:
+        rejection = check_admission(client, count)
+        if rejection:
+            return rejection
+        queue_state['receipts'] += count
+        queue_state['clients'][client] = queue_state['clients'].get(client, 0) + count
+    return None
+
+def release_receipts(client: str, count: int):
+    """Remove printed (or abandoned) receipts from the queue"""
+    if count <= 0:
+        return
+    with _queue_lock:
+        queue_state['receipts'] = max(0, queue_state['receipts'] - count)
+        remaining = queue_state['clients'].get(client, 0) - count
+        if remaining > 0:
+            queue_state['clients'][client] = remaining
+        else:
+            queue_state['clients'].pop(client, None)
+
+@contextlib.contextmanager
+def hold_printer():
+    """Take the printer for a job, timing the wait as the 'queue' stage"""
+    wait_start = time.time()
+    with print_lock:
+        add_timing('queue', time.time() - wait_start)
+        yield
+
+def record_receipt_seconds(seconds: float):
+    """Feed a measured receipt time into the drain-rate average"""
+    global receipt_seconds
+    receipt_seconds = receipt_seconds * 0.8 + seconds * 0.2
+
+# Memory budget - bytes held in request bodies, parsed jobs and rendered
+# receipts are accounted here. In LOW_MEMORY_MODE the budget is enforced:
+# bodies that do not fit are refused, and jobs that do not fit are spilled
+# to a temporary file and read back one entry at a time while printing.
+_memory_lock = threading.Lock()
+memory_usage = {'bodies': 0, 'jobs': 0, 'receipts': 0}
+memory_peak = {'bodies': 0, 'jobs': 0, 'receipts': 0, 'total': 0}
+spill_stats = {'spilledJobs': 0, 'spilledBytes': 0, 'activeSpills': 0}
+
+def reserve_memory(kind: str, size: int, required: bool = False) -> bool:
+    """Account for size bytes; in low-memory mode refuse if the budget would be exceeded"""
+    with _memory_lock:
+        total = sum(memory_usage.values())
+        if LOW_MEMORY_MODE and not required and total + size > MEMORY_BUDGET_BYTES:
+            return False
+        memory_usage[kind] += size
+        memory_peak[kind] = max(memory_peak[kind], memory_usage[kind])
+        memory_peak['total'] = max(memory_peak['total'], total + size)
+    return True
+
+def release_memory(kind: str, size: int):
+    """Return bytes reserved with reserve_memory"""
+    with _memory_lock:
+        memory_usage[kind] = max(0, memory_usage[kind] - size)
+
+class SpilledEntries:
+    """Job entries spilled to a temporary file, read back one at a time"""
+    
+    def __init__(self, entries: list):
+        # Deleted automatically when closed
+        self.file = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        for entry in entries:
+            self.file.write(json.dumps(entry) + '\n')
+        self.count = len(entries)
+        self.size = self.file.tell()
+        with _memory_lock:
+            spill_stats['spilledJobs'] += 1
+            spill_stats['spilledBytes'] += self.size
+            spill_stats['activeSpills'] += 1
+    
+    def __len__(self):
+        return self.count
+    
+    def __iter__(self):
+        self.file.seek(0)
+        for line in self.file:
+            yield json.loads(line)
+    
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            with _memory_lock:
+                spill_stats['activeSpills'] -= 1
+
+def get_rss_bytes() -> tuple:
+    """Current and peak resident set size of this process (None where unknown)"""
+    current = peak = None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports KiB, macOS bytes
+            if sys.platform != 'darwin':
+                peak *= 1024
+        except ImportError:
+            pass
+    return current, peak
+
+def get_memory_status() -> dict:
+    """Memory usage for GET /status"""
+    rss, peak_rss = get_rss_bytes()
+    return {
+        'lowMemoryMode': LOW_MEMORY_MODE,
+        'rssBytes': rss,
+        'peakRssBytes': peak_rss,
+        'budgetBytes': MEMORY_BUDGET_BYTES,
+        'usedBytes': sum(memory_usage.values()),
+        'peakUsedBytes': memory_peak['total'],
+        'buffers': dict(memory_usage),
+        'peakBuffers': {kind: memory_peak[kind] for kind in memory_usage},
+        'spill': dict(spill_stats)
+    }
+
+def apply_low_memory_mode():
+    """Shrink buffers and limits for low-memory hosts"""
+    global ADMISSION_MAX_BODY_BYTES, log_buffer
+    if not LOW_MEMORY_MODE:
+        return
+    # A single body must fit in the budget alongside its parsed form
+    ADMISSION_MAX_BODY_BYTES = min(ADMISSION_MAX_BODY_BYTES, MEMORY_BUDGET_BYTES // (PARSED_JSON_OVERHEAD + 1))
+    log_buffer = collections.deque(log_buffer, maxlen=min(LOG_BUFFER_SIZE, 200))
+
+# Print jobs - each job keeps a checkpoint of which receipts made it out,
+# so a printer fault mid-batch reports exact printed/failed indices
+job_checkpoints = collections.OrderedDict()
+_checkpoint_lock = threading.Lock()
+
+def start_checkpoint(job_id: str, total: int) -> dict:
+    """Create the checkpoint for a new job, dropping the oldest ones past the limit"""
+    checkpoint = {
+        'jobId': job_id,
+        'status': 'printing',
+        'total': total,
+        'printed': [],
+        'failed': [],
+        'errors': {},
+        'startedAt': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    with _checkpoint_lock:
+        job_checkpoints[job_id] = checkpoint
+        while len(job_checkpoints) > JOB_CHECKPOINT_LIMIT:
+            job_checkpoints.popitem(last=False)
+    return checkpoint
+
+def run_print_job(job_id: str, entries, settings: dict, client: str) -> dict:
+    """Print a batch of receipts and return the job checkpoint
+
+    entries may be a list or SpilledEntries; they are read in order once.
+    The caller must have reserved len(entries) receipts for client; they are
+    released here as each receipt finishes.
+    """
+    checkpoint = start_checkpoint(job_id, len(entries))
+    entry_delay = settings.get('entryDelay', 0.5)
+    released = 0
+    
+    # With multi-up layout several entries share one physical receipt
+    columns = multi_up_layout(settings)[0]
+    groups = [list(range(start, min(start + columns, len(entries))))
+              for start in range(0, len(entries), columns)]
+    
+    entry_iter = iter(entries)
+    
+    try:
+        # One job at a time so receipts stay together
+        with hold_printer():
+            for g, indices in enumerate(groups):
+                is_last = (g == len(groups) - 1)
+                group_entries = [next(entry_iter) for _ in indices]
+                receipt_start = time.time()
+                
+                try:
+                    # A group left with a single entry prints at full width
+                    if len(group_entries) > 1:
+                        receipt_data = render_multi_up(group_entries, settings, is_last)
+                    else:
+                        receipt_data = render_receipt(group_entries[0], settings, is_last)
+                    add_timing('render', time.time() - receipt_start)
+                except Exception as e:
+                    # Bad entry data - skip it, the printer is fine
+                    checkpoint['failed'].extend(indices)
+                    for i in indices:
+                        checkpoint['errors'][str(i)] = f"Invalid entry: {e}"
+                    release_receipts(client, len(indices))
+                    released += len(indices)
+                    continue
+                
+                reserve_memory('receipts', len(receipt_data), required=True)
+                try:
+                    send_with_recovery(receipt_data, job_id)
+                except Exception as e:
+                    # Printer could not be recovered - nothing from here on was printed
+                    checkpoint['failed'].extend(range(indices[0], len(entries)))
+                    checkpoint['errors'][str(indices[0])] = str(e)
+                    break
+                finally:
+                    release_memory('receipts', len(receipt_data))
+                
+                checkpoint['printed'].extend(indices)
+                if len(group_entries) > 1:
+                    # History holds each bale on its own so a reprint never
+                    # brings back the neighbouring slips
+                    history_start = time.time()
+                    for entry in group_entries:
+                        record_receipt(job_id, entry, render_receipt(entry, settings, True))
+                    add_timing('render', time.time() - history_start)
+                else:
+                    record_receipt(job_id, group_entries[0], receipt_data)
+                log_event(f"Print job {job_id} receipt {g + 1}/{len(groups)} done", 'debug',
+                          job_id=job_id, printer=printer_name, indices=indices,
+                          duration_ms=round((time.time() - receipt_start) * 1000, 1))
+                
+                # Apply delay between receipts (not after last one)
+                if not is_last:
+                    time.sleep(entry_delay)
+                    add_timing('delay', entry_delay)
+                # Drain estimate is per queued entry
+                record_receipt_seconds((time.time() - receipt_start) / len(indices))
+                release_receipts(client, len(indices))
+                released += len(indices)
+    finally:
+        release_receipts(client, len(entries) - released)
+        checkpoint['status'] = 'failed' if checkpoint['failed'] else 'completed'
+        checkpoint['finishedAt'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    return checkpoint
+
+def rejection_response(rejection: tuple) -> tuple:
+    """Build the (status, response) pair for a request the queue cannot take"""
+    status, error = rejection
+    return status, {
+        'success': False,
+        'error': error,
+        'queuedReceipts': queue_state['receipts'],
+        'retryAfter': retry_after_seconds()
+    }
+
+def submit_print_job(data: dict, client: str, size: int = 0) -> tuple:
+    """Admit and print a /print job payload; returns (status, response)
+
+    size is the encoded payload size, used to account for the job's memory.
+    """
+    # Take the entries out of data so a spilled job is not also kept in memory
+    entries = data.pop('entries', [])
+    if not entries:
+        return 400, {'error': 'No entries to print'}
+    if len(entries) > ADMISSION_MAX_ENTRIES:
+        return 413, {
+            'success': False,
+            'error': f'Too many entries ({len(entries)}), limit is {ADMISSION_MAX_ENTRIES}'
+        }
+    
+    settings = profile_settings(data.get('settings', {}))
+    try:
+        multi_up_layout(settings)
+        if int(settings.get('numberColumns') or 1) < 1:
+            raise ValueError('numberColumns must be at least 1')
+    except (TypeError, ValueError) as e:
+        return 400, {'success': False, 'error': f'Invalid layout: {e}'}
+    
+    rejection = reserve_receipts(client, len(entries))
+    if rejection:
+        return rejection_response(rejection)
+    
+    job_id = uuid.uuid4().hex[:8]
+    job_start = time.time()
+    
+    job_memory = size * PARSED_JSON_OVERHEAD
+    if not reserve_memory('jobs', job_memory):
+        entries = SpilledEntries(entries)
+        job_memory = 0
+        log_event(f"Print job {job_id} spilled to disk", job_id=job_id, bytes=entries.size)
+    
+    try:
+        # run_print_job releases the reserved receipts as it goes
+        checkpoint = run_print_job(job_id, entries, settings, client)
+    finally:
+        release_memory('jobs', job_memory)
+        if isinstance(entries, SpilledEntries):
+            entries.close()
+    
+    response = {
+        'success': not checkpoint['failed'],
+        'jobId': job_id,
+        'printed': len(checkpoint['printed']),
+        'printedIndices': checkpoint['printed'],
+        'failedIndices': checkpoint['failed']
+    }
+    if checkpoint['failed']:
+        response['errors'] = checkpoint['errors']
+        log_event(f"Print job {job_id} incomplete", 'error', job_id=job_id, printer=printer_name,
+                  printed=len(checkpoint['printed']), failed=len(checkpoint['failed']))
+        return 500, response
+    
+    log_event(f"Print job {job_id} completed", job_id=job_id, printer=printer_name,
+              receipts=len(entries), duration_ms=round((time.time() - job_start) * 1000, 1))
+    return 200, response
+
+def submit_raw_job(raw_data: bytes, client: str) -> tuple:
+    """Admit and print raw ESC/POS bytes; returns (status, response)"""
+    rejection = reserve_receipts(client, 1)
+    if rejection:
+        return rejection_response(rejection)
+    
+    reserve_memory('receipts', len(raw_data), required=True)
+    try:
+        raw_start = time.time()
+        with hold_printer():
+            send_with_recovery(raw_data)
+        log_event("Raw print completed", printer=printer_name, bytes=len(raw_data),
+                  duration_ms=round((time.time() - raw_start) * 1000, 1))
+    finally:
+        release_memory('receipts', len(raw_data))
+        release_receipts(client, 1)
+    
+    return 200, {'success': True}
+
+def get_status() -> dict:
+    """Printer and queue status (GET /status)"""
+    return {
+        'printer': printer_name,
+        'connected': printer is not None,
+        'version': VERSION,
+        'queuedReceipts': queue_state['receipts'],
+        'estimatedDrainSeconds': round(estimate_drain_seconds(), 1),
+        'memory': get_memory_status()
+    }
 
 class PrintServerHandler(BaseHTTPRequestHandler):
     """HTTP request handler for print server"""
@@ -491,15 +1581,85 @@ class PrintServerHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Timing-Allow-Origin', '*')
     
-    def _send_json_response(self, data: dict, status: int = 200):
+    def _send_json_response(self, data: dict, status: int = 200, headers: dict = None):
         """Send JSON response"""
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self._send_cors_headers()
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        server_timing = format_server_timing()
+        if server_timing:
+            self.send_header('Server-Timing', server_timing)
         self.end_headers()
         self.wfile.write(json.dumps(data).encode('utf-8'))
     
+    def _send_file_response(self, data: bytes, content_type: str, filename: str):
+        """Send a downloadable file"""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Content-Length', str(len(data)))
+        self._send_cors_headers()
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _reject(self, status: int, error: str):
+        """Reject a request without reading its body"""
+        # The unread body would be parsed as the next request, so drop the connection
+        self.close_connection = True
+        headers = {'Connection': 'close'}
+        if status in (429, 503):
+            headers['Retry-After'] = str(retry_after_seconds())
+        log_event(f"Rejected {self.path}: {error}", 'warning', client=self.client_address[0], status=status)
+        self._send_json_response({
+            'success': False,
+            'error': error,
+            'queuedReceipts': queue_state['receipts']
+        }, status, headers)
+    
+    def _send_job_result(self, status: int, response: dict):
+        """Send a job submission result, with Retry-After when the queue was full"""
+        headers = {}
+        if status in (429, 503):
+            headers['Retry-After'] = str(response.get('retryAfter', retry_after_seconds()))
+        self._send_json_response(response, status, headers)
+    
+    def _admit_body(self, receipts: int = 1) -> bool:
+        """Check body size and queue capacity before the body is read"""
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self._reject(411, 'Content-Length required')
+            return False
+        if int(length) > ADMISSION_MAX_BODY_BYTES:
+            self._reject(413, f'Request body larger than {ADMISSION_MAX_BODY_BYTES} bytes')
+            return False
+        rejection = check_admission(self.client_address[0], receipts)
+        if rejection:
+            self._reject(*rejection)
+            return False
+        if not reserve_memory('bodies', int(length)):
+            self._reject(503, 'Server memory budget exhausted')
+            return False
+        return True
+    
+    def _read_json_body(self) -> dict:
+        """Read and parse the JSON request body"""
+        # The body's memory was reserved by _admit_body and is released once parsed
+        content_length = int(self.headers['Content-Length'])
+        try:
+            read_start = time.time()
+            body = self.rfile.read(content_length)
+            parse_start = time.time()
+            add_timing('read', parse_start - read_start)
+            data = json.loads(body.decode('utf-8'))
+            add_timing('parse', time.time() - parse_start)
+        finally:
+            release_memory('bodies', content_length)
+        return data
+    
     def do_OPTIONS(self):
         """Handle preflight CORS requests"""
         self.send_response(200)
@@ -508,6 +1668,7 @@ class PrintServerHandler(BaseHTTPRequestHandler):
     
     def do_GET(self):
         """Handle GET requests"""
+        reset_timings()
         parsed = urlparse(self.path)
         
         if parsed.path == '/':
@@ -522,11 +1683,7 @@ class PrintServerHandler(BaseHTTPRequestHandler):
         
         elif parsed.path == '/status':
             # Printer status
-            self._send_json_response({
-                'printer': printer_name,
-                'connected': printer is not None,
-                'version': VERSION
-            })
+            self._send_json_response(get_status())
         
         elif parsed.path == '/version':
             # Version info endpoint
@@ -535,9 +1692,93 @@ class PrintServerHandler(BaseHTTPRequestHandler):
                 'repo': GITHUB_REPO
             })
         
+        elif parsed.path == '/logs':
+            # Recent log records from the in-memory ring buffer
+            params = parse_qs(parsed.query)
+            try:
+                limit = int(params.get('limit', ['100'])[0])
+            except ValueError:
+                limit = 100
+            self._send_json_response({
+                'logs': get_logs(limit, params.get('level', [None])[0], params.get('job', [None])[0]),
+                'dropped': log_stats['dropped'],
+                'suppressed': log_stats['suppressed']
+            })
+        
+        elif parsed.path == '/history':
+            # Search printed receipts by lot, serial, date (YYYY-MM-DD) or job
+            params = parse_qs(parsed.query)
+            try:
+                receipts = find_history(
+                    lot=params.get('lot', [None])[0],
+                    serial=params.get('serial', [None])[0],
+                    date=params.get('date', [None])[0],
+                    job_id=params.get('job', [None])[0],
+                    limit=int(params.get('limit', ['50'])[0])
+                )
+                self._send_json_response({'receipts': receipts})
+            except ValueError as e:
+                self._send_json_response({'error': str(e)}, 400)
+            except Exception as e:
+                self._send_json_response({'error': str(e)}, 500)
+        
+        elif parsed.path == '/job':
+            # Checkpoint of a recent print job
+            job_id = parse_qs(parsed.query).get('id', [None])[0]
+            checkpoint = job_checkpoints.get(job_id)
+            if checkpoint is None:
+                self._send_json_response({'error': 'Unknown job'}, 404)
+            else:
+                self._send_json_response(checkpoint)
+        
+        elif parsed.path == '/debug/profile':
+            # Sampling profile of the running server (disabled unless DEBUG_PROFILE_ENABLED)
+            if not DEBUG_PROFILE_ENABLED:
+                self._send_json_response({'error': 'Not found'}, 404)
+                return
+            params = parse_qs(parsed.query)
+            try:
+                seconds = float(params.get('seconds', ['10'])[0])
+            except ValueError:
+                self._send_json_response({'error': 'seconds must be a number'}, 400)
+                return
+            seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+            output = params.get('format', ['collapsed'])[0]
+            if output not in ('collapsed', 'pstats'):
+                self._send_json_response({'error': 'format must be collapsed or pstats'}, 400)
+                return
+            if not _profile_lock.acquire(blocking=False):
+                self._send_json_response({'error': 'A profile is already running'}, 409)
+                return
+            try:
+                log_event(f"Profiling for {seconds:.1f}s", format=output)
+                samples = sample_stacks(seconds, PROFILE_INTERVAL)
+            finally:
+                _profile_lock.release()
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            if output == 'pstats':
+                self._send_file_response(format_pstats(samples, PROFILE_INTERVAL),
+                                         'application/octet-stream', f'profile-{stamp}.pstats')
+            else:
+                self._send_file_response(format_collapsed(samples), 'text/plain; charset=utf-8',
+                                         f'profile-{stamp}.collapsed.txt')
+        
+        elif parsed.path == '/printer-profile':
+            # Capability profile of the connected printer
+            self._send_json_response({
+                'printer': printer_name,
+                'key': printer_key,
+                'profile': printer_profile
+            })
+        
         elif parsed.path == '/reconnect':
-            # Try to reconnect printer
-            connected = connect_printer()
+            # Try to reconnect printer (waits for the current job to finish)
+            # ?probe=1 re-queries the printer instead of using its saved profile
+            force_probe = parse_qs(parsed.query).get('probe', ['0'])[0] in ('1', 'true')
+            with print_lock:
+                connected = connect_printer()
+                if connected and force_probe:
+                    load_printer_profile(force_probe=True)
             self._send_json_response({
                 'success': connected,
                 'printer': printer_name
@@ -548,37 +1789,19 @@ class PrintServerHandler(BaseHTTPRequestHandler):
     
     def do_POST(self):
         """Handle POST requests"""
+        reset_timings()
         parsed = urlparse(self.path)
         
+        client = self.client_address[0]
+        
         if parsed.path == '/print':
+            if not self._admit_body():
+                return
             try:
-                content_length = int(self.headers['Content-Length'])
-                body = self.rfile.read(content_length)
-                data = json.loads(body.decode('utf-8'))
-                
-                entries = data.get('entries', [])
-                if not entries:
-                    self._send_json_response({'error': 'No entries to print'}, 400)
-                    return
-                
-                # Get print settings
-                settings = data.get('settings', {})
-                entry_delay = settings.get('entryDelay', 0.5)
-                
-                # Print each entry
-                for i, entry in enumerate(entries):
-                    is_last = (i == len(entries) - 1)
-                    print_receipt(entry, settings, is_last)
-                    # Apply delay between entries (not after last one)
-                    if not is_last:
-                        time.sleep(entry_delay)
-                
-                self._send_json_response({
-                    'success': True,
-                    'printed': len(entries)
-                })
-                
+                data = self._read_json_body()
+                self._send_job_result(*submit_print_job(data, client, int(self.headers['Content-Length'])))
             except Exception as e:
+                log_event(f"Print job failed: {e}", 'error', printer=printer_name)
                 self._send_json_response({
                     'success': False,
                     'error': str(e)
@@ -586,68 +1809,591 @@ class PrintServerHandler(BaseHTTPRequestHandler):
         
         elif parsed.path == '/print-raw':
             # Print raw ESC/POS data
+            if not self._admit_body():
+                return
             try:
-                content_length = int(self.headers['Content-Length'])
-                body = self.rfile.read(content_length)
-                data = json.loads(body.decode('utf-8'))
+                data = self._read_json_body()
+                self._send_job_result(*submit_raw_job(bytes(data.get('data', [])), client))
+            except Exception as e:
+                log_event(f"Raw print failed: {e}", 'error', printer=printer_name)
+                self._send_json_response({
+                    'success': False,
+                    'error': str(e)
+                }, 500)
+        
+        elif parsed.path == '/reprint':
+            # Resend stored receipt bytes from the print history
+            if not self._admit_body():
+                return
+            reserved = 0
+            try:
+                data = self._read_json_body()
+                
+                ids = data.get('ids') or ([data['id']] if 'id' in data else [])
+                if not ids:
+                    lot = data.get('markaLotNumber')
+                    serial = data.get('serialNumber') or data.get('baleNumber')
+                    if not lot and not serial:
+                        self._send_json_response({'error': 'Give id, ids, or markaLotNumber/serialNumber'}, 400)
+                        return
+                    # Most recent matching receipt
+                    matches = find_history(lot=lot, serial=serial, limit=1)
+                    ids = [m['id'] for m in matches]
                 
-                raw_data = bytes(data.get('data', []))
-                send_to_printer(raw_data)
+                if not isinstance(ids, list):
+                    self._send_json_response({'error': 'ids must be a list'}, 400)
+                    return
+                if len(ids) > ADMISSION_MAX_ENTRIES:
+                    self._reject(413, f'Too many ids ({len(ids)}), limit is {ADMISSION_MAX_ENTRIES}')
+                    return
+                try:
+                    ids = [int(receipt_id) for receipt_id in ids]
+                except (TypeError, ValueError):
+                    self._send_json_response({'error': 'ids must be integers'}, 400)
+                    return
+                if not ids:
+                    self._send_json_response({'error': 'No matching receipt in history'}, 404)
+                    return
+                found = existing_history_ids(ids)
+                missing = [receipt_id for receipt_id in ids if receipt_id not in found]
+                if missing:
+                    self._send_json_response({'error': f'Receipt {missing[0]} not found in history'}, 404)
+                    return
                 
-                self._send_json_response({'success': True})
+                rejection = reserve_receipts(client, len(ids))
+                if rejection:
+                    self._reject(*rejection)
+                    return
+                reserved = len(ids)
+                
+                # Load one receipt at a time so only one is held in memory
+                with hold_printer():
+                    for receipt_id in ids:
+                        receipt_data = load_history_receipt(receipt_id)
+                        if receipt_data is None:
+                            # Pruned since the check above
+                            raise Exception(f'Receipt {receipt_id} no longer in history')
+                        reserve_memory('receipts', len(receipt_data), required=True)
+                        try:
+                            send_with_recovery(receipt_data)
+                        finally:
+                            release_memory('receipts', len(receipt_data))
+                        release_receipts(client, 1)
+                        reserved -= 1
+                
+                log_event(f"Reprinted {len(ids)} receipts", printer=printer_name, ids=ids)
+                self._send_json_response({
+                    'success': True,
+                    'reprinted': len(ids),
+                    'ids': ids
+                })
                 
             except Exception as e:
+                log_event(f"Reprint failed: {e}", 'error', printer=printer_name)
                 self._send_json_response({
                     'success': False,
                     'error': str(e)
                 }, 500)
+            finally:
+                release_receipts(client, reserved)
         
         else:
             self._send_json_response({'error': 'Not found'}, 404)
     
+    def log_request(self, code='-', size='-'):
+        """Access log line: request line and status code"""
+        if isinstance(code, HTTPStatus):
+            code = code.value
+        log_event(f"{self.requestline} {code}", client=self.client_address[0])
+    
+    def log_error(self, format, *args):
+        """Errors reported by the base handler (send_error, timeouts)"""
+        log_event(format % args, 'warning', client=self.client_address[0])
+    
     def log_message(self, format, *args):
-        """Custom log format"""
-        print(f"[{self.log_date_time_string()}] {args[0]}")
+        """Custom log format - routed through the non-blocking logger"""
+        log_event(format % args, client=self.client_address[0])
+
+# Raw TCP ingress - JetDirect-style pass-through for POS software that
+# speaks ESC/POS directly. Each connection is one job; bytes are copied to
+# the printer chunk by chunk, so nothing is buffered beyond one chunk and a
+# slow printer pushes back on the sender through TCP flow control.
+class RawPrintServer(socketserver.ThreadingTCPServer):
+    """Raw TCP listener for pass-through ESC/POS printing"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+class RawPrintHandler(socketserver.BaseRequestHandler):
+    """Stream one connection's bytes straight to the printer as a single job"""
+    
+    def handle(self):
+        client = self.client_address[0]
+        rejection = reserve_receipts(client, 1)
+        if rejection:
+            log_event(f"Rejected raw connection: {rejection[1]}", 'warning', client=client)
+            return
+        
+        job_id = uuid.uuid4().hex[:8]
+        buffer = bytearray(RAW_CHUNK_SIZE)
+        view = memoryview(buffer)
+        total = 0
+        job_start = time.time()
+        self.request.settimeout(RAW_IDLE_TIMEOUT)
+        
+        try:
+            # Wait for the first chunk before taking the printer, so an idle
+            # connection does not hold up other jobs
+            received = self._recv(buffer)
+            if not received:
+                return
+            with hold_printer(), printer_document(f"Raw Job {job_id}"):
+                # A trickling client must not keep the printer from other jobs
+                deadline = time.time() + RAW_MAX_JOB_SECONDS
+                while received:
+                    send_with_recovery(bytes(view[:received]), job_id)
+                    total += received
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.request.settimeout(min(RAW_IDLE_TIMEOUT, remaining))
+                    received = self._recv(buffer)
+                if time.time() >= deadline:
+                    log_event(f"Raw job {job_id} cut off after {RAW_MAX_JOB_SECONDS:.0f}s", 'warning',
+                              job_id=job_id, client=client, bytes=total)
+            log_event(f"Raw job {job_id} completed", job_id=job_id, printer=printer_name, client=client,
+                      bytes=total, duration_ms=round((time.time() - job_start) * 1000, 1))
+        except Exception as e:
+            log_event(f"Raw job {job_id} failed: {e}", 'error', job_id=job_id, printer=printer_name,
+                      client=client, bytes=total)
+        finally:
+            release_receipts(client, 1)
+    
+    def _recv(self, buffer) -> int:
+        """Read the next chunk into buffer; 0 means the job is over"""
+        try:
+            return self.request.recv_into(buffer)
+        except socket.timeout:
+            return 0
+
+def start_raw_server(port: int):
+    """Start the raw TCP listener on a background thread"""
+    try:
+        raw_server = RawPrintServer(('0.0.0.0', port), RawPrintHandler)
+    except OSError as e:
+        print(f"  (Raw print port {port} unavailable: {e})")
+        return None
+    threading.Thread(target=raw_server.serve_forever, name='raw-server', daemon=True).start()
+    return raw_server
+
+# Unix socket ingress - for POS apps on the same machine. Skips TCP, HTTP
+# and CORS entirely. Each frame is a 1-byte type and a 4-byte big-endian
+# payload length followed by the payload; every request frame gets one
+# response frame of the same type carrying a JSON result.
+FRAME_HEADER = struct.Struct('>BI')
+FRAME_PRINT = ord('P')      # Payload: same JSON as POST /print
+FRAME_RAW = ord('R')        # Payload: raw ESC/POS bytes (not a JSON list)
+FRAME_STATUS = ord('S')     # Payload: empty; response is GET /status
+
+# Windows Python has no AF_UNIX (and so no UnixStreamServer)
+if hasattr(socket, 'AF_UNIX'):
+    class UnixPrintServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """Unix domain socket listener for co-located clients"""
+        daemon_threads = True
+
+class UnixPrintHandler(socketserver.StreamRequestHandler):
+    """Handle length-prefixed job frames until the client disconnects"""
+    
+    def handle(self):
+        while True:
+            header = self.rfile.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            frame_type, length = FRAME_HEADER.unpack(header)
+            if length > ADMISSION_MAX_BODY_BYTES:
+                # The payload is not read, so the stream cannot be resynchronised
+                self._send_frame(frame_type, 413, {
+                    'success': False,
+                    'error': f'Payload larger than {ADMISSION_MAX_BODY_BYTES} bytes'
+                })
+                return
+            if not reserve_memory('bodies', length):
+                # Skip the payload to stay in sync with the framing
+                remaining = length
+                while remaining > 0:
+                    skipped = len(self.rfile.read(min(remaining, 65536)))
+                    if not skipped:
+                        return
+                    remaining -= skipped
+                self._send_frame(frame_type, 503, {
+                    'success': False,
+                    'error': 'Server memory budget exhausted',
+                    'retryAfter': retry_after_seconds()
+                })
+                continue
+            try:
+                payload = self.rfile.read(length)
+                if len(payload) < length:
+                    return
+                if frame_type == FRAME_PRINT:
+                    data = json.loads(payload.decode('utf-8'))
+                    payload = None
+            except Exception as e:
+                self._send_frame(frame_type, 400, {'success': False, 'error': str(e)})
+                continue
+            finally:
+                release_memory('bodies', length)
+            
+            try:
+                if frame_type == FRAME_PRINT:
+                    status, response = submit_print_job(data, 'unix', length)
+                elif frame_type == FRAME_RAW:
+                    status, response = submit_raw_job(payload, 'unix')
+                elif frame_type == FRAME_STATUS:
+                    status, response = 200, get_status()
+                else:
+                    status, response = 400, {'error': f'Unknown frame type {frame_type}'}
+            except Exception as e:
+                log_event(f"Unix socket job failed: {e}", 'error', printer=printer_name)
+                status, response = 500, {'success': False, 'error': str(e)}
+            
+            self._send_frame(frame_type, status, response)
+    
+    def _send_frame(self, frame_type: int, status: int, response: dict):
+        """Send one response frame"""
+        response['status'] = status
+        payload = json.dumps(response).encode('utf-8')
+        self.wfile.write(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+
+def socket_in_use(path: str) -> bool:
+    """Whether a server is still accepting connections on a Unix socket"""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+def start_unix_server(path: str):
+    """Start the Unix socket listener on a background thread"""
+    if not hasattr(socket, 'AF_UNIX'):
+        print("  (Unix socket not supported on this platform)")
+        return None
+    try:
+        # Only remove a socket left behind by an earlier run - never a regular
+        # file at a mistyped path or the socket of a server that is still live
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                print(f"  (Unix socket {path} unavailable: path exists and is not a socket)")
+                return None
+            if socket_in_use(path):
+                print(f"  (Unix socket {path} unavailable: another server is listening on it)")
+                return None
+            os.unlink(path)
+        # Create the socket with its final permissions - no window where
+        # other users could connect
+        old_umask = os.umask(0o777 & ~UNIX_SOCKET_MODE)
+        try:
+            unix_server = UnixPrintServer(path, UnixPrintHandler)
+        finally:
+            os.umask(old_umask)
+    except OSError as e:
+        print(f"  (Unix socket {path} unavailable: {e})")
+        return None
+    threading.Thread(target=unix_server.serve_forever, name='unix-server', daemon=True).start()
+    return unix_server
+
+# Printer capabilities - each printer is queried once (status support,
+# model/firmware via GS I, serial baud rate) and the result is saved per
+# device so later connects reuse it instead of probing again
+def get_printer_profiles_path() -> str:
+    """Get the capability profile file path (next to the exe or script by default)"""
+    if PRINTER_PROFILES_PATH:
+        return PRINTER_PROFILES_PATH
+    if getattr(sys, 'frozen', False):
+        base_dir = os.path.dirname(sys.executable)
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, 'printer_profiles.json')
+
+def load_printer_profiles() -> dict:
+    """Read all saved capability profiles"""
+    try:
+        with open(get_printer_profiles_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log_event(f"Could not read printer profiles: {e}", 'warning')
+        return {}
+
+def save_printer_profile(key: str, profile: dict):
+    """Save one capability profile, keeping the others"""
+    profiles = load_printer_profiles()
+    profiles[key] = profile
+    path = get_printer_profiles_path()
+    try:
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(profiles, f, indent=2)
+        os.replace(temp_path, path)
+    except Exception as e:
+        log_event(f"Could not save printer profile: {e}", 'warning')
+
+def is_serial_printer() -> bool:
+    """Check if the connected printer is a serial port"""
+    return hasattr(printer, 'read') and hasattr(printer, 'baudrate')
+
+def read_from_printer(size: int = 64, timeout: float = 0.5) -> bytes:
+    """Read a response from the printer, or b'' if it cannot answer"""
+    try:
+        if printer_in is not None:
+            return bytes(printer_in.read(max(size, printer_in.wMaxPacketSize), timeout=int(timeout * 1000)))
+        if is_serial_printer():
+            printer.timeout = timeout
+            return printer.read(size)
+    except Exception:
+        pass
+    return b''
+
+def query_printer(command: bytes, timeout: float = 0.5) -> bytes:
+    """Send a query command and return the printer's reply"""
+    # Drop any stale bytes so they are not taken as the reply
+    if is_serial_printer():
+        printer.reset_input_buffer()
+    elif printer_in is not None:
+        while read_from_printer(timeout=0.05):
+            pass
+    send_to_printer(command)
+    return read_from_printer(timeout=timeout)
+
+def query_printer_info(n: int) -> str:
+    """Query GS I n; text replies are framed as '_' ... NUL, ID replies are one byte"""
+    reply = query_printer(bytes([GS, 0x49, n]))
+    if not reply:
+        return None
+    if reply[:1] == b'_':
+        return reply[1:].split(b'\x00')[0].decode('ascii', 'replace').strip() or None
+    if n < 0x40:
+        return f"0x{reply[0]:02x}"
+    return None
+
+def is_status_reply(reply: bytes) -> bool:
+    """Check for a valid DLE EOT 1 status byte (bit pattern 0xx1xx10)"""
+    return len(reply) >= 1 and (reply[0] & 0x93) == 0x12
+
+def guess_chars_per_line(*names) -> int:
+    """Guess paper width from model/product names mentioning 80mm or 58mm"""
+    for name in names:
+        # Only an explicit paper width counts - model numbers and serials often contain 58/80
+        match = re.search(r'\b(80|58)\s*mm\b', name or '', re.IGNORECASE)
+        if match:
+            return 48 if match.group(1) == '80' else 32
+    return PAPER_CHARS_PER_LINE
+
+def default_printer_profile() -> dict:
+    """Profile for a printer that has not been queried (no device I/O)"""
+    return {
+        'name': printer_name,
+        'model': None,
+        'manufacturer': None,
+        'firmware': None,
+        'statusSupported': False,
+        'charsPerLine': guess_chars_per_line(printer_name),
+        'chunkSize': PRINTER_CHUNK_SIZE,
+        'chunkDelay': 0,
+        'probedAt': None,
+    }
+
+def probe_printer() -> dict:
+    """Query the connected printer's capabilities"""
+    profile = default_printer_profile()
+    profile['probedAt'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    if printer_in is None and not is_serial_printer():
+        # Windows spooler handles and USB printers without an IN endpoint cannot answer
+        return profile
+    
+    reply = query_printer(bytes([DLE, EOT, 1]))
+    if is_serial_printer():
+        # No valid reply may mean the wrong baud rate - try the others
+        if not is_status_reply(reply):
+            for baudrate in SERIAL_BAUD_RATES:
+                printer.baudrate = baudrate
+                reply = query_printer(bytes([DLE, EOT, 1]))
+                if is_status_reply(reply):
+                    break
+            else:
+                printer.baudrate = SERIAL_BAUD_RATES[0]
+        profile['baudrate'] = printer.baudrate
+        # Pace serial writes to roughly the line rate (10 bits per byte)
+        profile['chunkSize'] = min(PRINTER_CHUNK_SIZE, 256)
+        profile['chunkDelay'] = round(profile['chunkSize'] * 10 / printer.baudrate, 3)
+    profile['statusSupported'] = is_status_reply(reply)
+    
+    if profile['statusSupported']:
+        profile['manufacturer'] = query_printer_info(0x42)
+        profile['model'] = query_printer_info(0x43) or query_printer_info(1)
+        profile['firmware'] = query_printer_info(0x41) or query_printer_info(3)
+    else:
+        # Printer cannot answer - go gently on its buffer
+        profile['chunkSize'] = min(profile['chunkSize'], 512)
+    
+    profile['charsPerLine'] = guess_chars_per_line(profile['model'], printer_name)
+    return profile
+
+def load_printer_profile(force_probe: bool = False):
+    """Load the saved profile for the connected printer, probing it the first time"""
+    global printer_profile
+    if printer is None or printer_key is None:
+        printer_profile = {}
+        return
+    
+    profile = None if force_probe else load_printer_profiles().get(printer_key)
+    if profile is None and not PRINTER_PROBE_ENABLED and not force_probe:
+        # Probing is off - never send queries the printer did not ask for
+        profile = default_printer_profile()
+    elif profile is None:
+        try:
+            # Clear any old profile so probing uses plain writes
+            printer_profile = {}
+            profile = probe_printer()
+        except Exception as e:
+            log_event(f"Printer probe failed: {e}", 'warning', printer=printer_name)
+            return
+        save_printer_profile(printer_key, profile)
+        log_event("Printer profile created", printer=printer_name, key=printer_key,
+                  model=profile['model'], charsPerLine=profile['charsPerLine'])
+    elif 'baudrate' in profile and is_serial_printer():
+        printer.baudrate = profile['baudrate']
+    
+    printer_profile = profile
+
+def profile_settings(settings: dict) -> dict:
+    """Fill in print settings the client left out from the printer profile"""
+    settings = dict(settings or {})
+    if not settings.get('charsPerLine') and printer_profile.get('charsPerLine'):
+        settings['charsPerLine'] = printer_profile['charsPerLine']
+    return settings
 
 def connect_printer():
     """Try to connect to printer using available methods"""
     if sys.platform == 'win32':
-        return find_printer_windows()
+        connected = find_printer_windows()
     else:
-        return find_printer_usb() or find_printer_serial()
+        connected = find_printer_usb() or find_printer_serial()
+    if connected:
+        load_printer_profile()
+    return connected
+
+def get_mdns_properties() -> dict:
+    """Build the mDNS TXT record with live capacity for client-side load balancing"""
+    if printer is None:
+        state = 'offline'
+    elif queue_state['receipts'] > 0:
+        state = 'busy'
+    else:
+        state = 'ready'
+    return {
+        'path': '/',
+        'service': 'Thermal Print Server',
+        'version': VERSION,
+        'host': socket.gethostname(),
+        'printer': printer_name,
+        'state': state,
+        'queue': str(queue_state['receipts']),
+        # Whole seconds, so small fluctuations do not cause a TXT update
+        'drain': str(int(estimate_drain_seconds() + 0.5)),
+    }
+
+def _mdns_updater(zeroconf, service_infos: list, stop_event):
+    """Background thread that re-announces TXT records when capacity changes"""
+    from zeroconf import ServiceInfo
+    
+    last_properties = get_mdns_properties()
+    last_update = time.time()
+    while not stop_event.wait(1.0):
+        properties = get_mdns_properties()
+        if properties == last_properties or time.time() - last_update < MDNS_MIN_UPDATE_SECONDS:
+            continue
+        try:
+            for i, info in enumerate(service_infos):
+                if info.type == MDNS_ALIAS_SERVICE_TYPE:
+                    continue
+                updated = ServiceInfo(
+                    info.type,
+                    info.name,
+                    addresses=info.addresses,
+                    port=info.port,
+                    properties=properties,
+                    server=info.server
+                )
+                zeroconf.update_service(updated)
+                service_infos[i] = updated
+            last_properties = properties
+            last_update = time.time()
+        except Exception as e:
+            log_event(f"mDNS update failed: {e}", 'warning')
+
+def get_mdns_hostname() -> str:
+    """This machine's host name as a valid .local label"""
+    label = socket.gethostname().split('.')[0].lower()
+    label = re.sub(r'[^a-z0-9-]+', '-', label).strip('-')
+    return label or 'printserver'
 
 def setup_mdns(port: int, local_ip: str):
     """Set up mDNS/Bonjour service advertisement"""
     try:
         from zeroconf import Zeroconf, ServiceInfo
-        import socket
-        
-        # Create service info
-        service_type = "_http._tcp.local."
-        service_name = "Thermal Print Server._http._tcp.local."
-        
-        # Get hostname
-        hostname = "printserver"
-        
-        service_info = ServiceInfo(
-            service_type,
-            service_name,
-            addresses=[socket.inet_aton(local_ip)],
-            port=port,
-            properties={
-                'path': '/',
-                'service': 'Thermal Print Server',
-                'version': '1.0.0'
-            },
-            server=f"{hostname}.local."
-        )
+        
+        # Instance names and SRV targets use this machine's host name so several
+        # servers on one LAN do not collide. The dedicated service type lets
+        # clients browse for print servers only; _http._tcp is kept for
+        # existing clients.
+        # A host name may be a FQDN; dots cannot appear inside an instance label
+        instance = f"Thermal Print Server ({socket.gethostname().split('.')[0]})"
+        hostname = get_mdns_hostname()
+        properties = get_mdns_properties()
         
         zeroconf = Zeroconf()
-        zeroconf.register_service(service_info)
+        service_infos = []
+        for service_type in (MDNS_SERVICE_TYPE, "_http._tcp.local."):
+            service_info = ServiceInfo(
+                service_type,
+                f"{instance}.{service_type}",
+                addresses=[socket.inet_aton(local_ip)],
+                port=port,
+                properties=properties,
+                server=f"{hostname}.local."
+            )
+            zeroconf.register_service(service_info, allow_name_change=True)
+            service_infos.append(service_info)
+        
+        # The alias gets its own record so it never becomes the SRV target of
+        # the browsable services. zeroconf only answers for addresses that
+        # belong to a registered service, so it is carried by a service of its own.
+        if MDNS_HOSTNAME and MDNS_HOSTNAME.lower() != hostname:
+            alias_info = ServiceInfo(
+                MDNS_ALIAS_SERVICE_TYPE,
+                f"{instance}.{MDNS_ALIAS_SERVICE_TYPE}",
+                addresses=[socket.inet_aton(local_ip)],
+                port=port,
+                server=f"{MDNS_HOSTNAME}.local."
+            )
+            zeroconf.register_service(alias_info, allow_name_change=True)
+            service_infos.append(alias_info)
+        
+        stop_event = threading.Event()
+        threading.Thread(target=_mdns_updater, args=(zeroconf, service_infos, stop_event),
+                         name='mdns-updater', daemon=True).start()
         
         print(f"  mDNS Name:   http://{hostname}.local:{port}")
+        if MDNS_HOSTNAME and MDNS_HOSTNAME.lower() != hostname:
+            print(f"  mDNS Alias:  http://{MDNS_HOSTNAME}.local:{port}")
+        print(f"  mDNS Service: {service_infos[0].name}")
         
-        return zeroconf, service_info
+        return zeroconf, (service_infos, stop_event)
         
     except ImportError:
         print("  (mDNS not available - install zeroconf package)")
@@ -769,7 +2515,7 @@ rm "$0"
 
 def main():
     """Main entry point"""
-    PORT = 9100
+    PORT = HTTP_PORT
     
     print("=" * 50)
     print("  Thermal Printer Network Server")
@@ -777,13 +2523,20 @@ def main():
     print("=" * 50)
     print()
     
+    apply_low_memory_mode()
+    if LOW_MEMORY_MODE:
+        print(f"Low-memory mode: budget {MEMORY_BUDGET_BYTES // 1024} KiB")
+        print()
+    
     # Check for updates
     check_for_updates()
     print()
     
     # Connect to printer
     print("Searching for printer...")
-    if connect_printer():
+    connected = connect_printer()
+    flush_logs()
+    if connected:
         print(f"Printer ready: {printer_name}")
     else:
         print("Warning: No printer connected. Will retry on print requests.")
@@ -794,15 +2547,25 @@ def main():
     local_ip = get_local_ip()
     
     # Start HTTP server
-    server = HTTPServer(('0.0.0.0', PORT), PrintServerHandler)
+    server = ThreadingHTTPServer(('0.0.0.0', PORT), PrintServerHandler)
     
     print(f"Server started!")
     print(f"")
     print(f"  Local URL:   http://localhost:{PORT}")
     print(f"  Network URL: http://{local_ip}:{PORT}")
     
+    # Start raw ESC/POS listener
+    raw_server = start_raw_server(RAW_PORT) if RAW_PORT else None
+    if raw_server:
+        print(f"  Raw Port:    {local_ip}:{RAW_PORT}")
+    
+    # Start local Unix socket listener
+    unix_server = start_unix_server(UNIX_SOCKET_PATH) if UNIX_SOCKET_PATH else None
+    if unix_server:
+        print(f"  Unix Socket: {UNIX_SOCKET_PATH}")
+    
     # Set up mDNS
-    zeroconf, service_info = setup_mdns(PORT, local_ip)
+    zeroconf, mdns_services = setup_mdns(PORT, local_ip)
     
     print(f"")
     print(f"Use Network URL or mDNS Name in your app's Print Settings.")
@@ -813,10 +2576,25 @@ def main():
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nShutting down...")
-        if zeroconf and service_info:
-            zeroconf.unregister_service(service_info)
+        if zeroconf and mdns_services:
+            service_infos, stop_event = mdns_services
+            stop_event.set()
+            for info in service_infos:
+                zeroconf.unregister_service(info)
             zeroconf.close()
         server.server_close()
+        if raw_server:
+            raw_server.shutdown()
+            raw_server.server_close()
+        if unix_server:
+            unix_server.shutdown()
+            unix_server.server_close()
+            try:
+                os.unlink(UNIX_SOCKET_PATH)
+            except OSError:
+                pass
+        flush_history()
+        stop_log_writer()
         print("Server stopped.")
 
 if __name__ == '__main__':